@@ -17,9 +17,13 @@ from homeassistant.device import HomeAssistantDevice
 from homeassistant.number import HomeAssistantNumber
 from homeassistant.sensor import HomeAssistantSensor
 from homeassistant.device_class import DeviceClass
+from live_config import LiveConfig
 from memory import BackupRAM
 from micropython import const
 from network import MagtagNetwork
+from rollup import Rollup
+from scheduler import WakeScheduler
+from sensor_settings import SensorSettings
 from secrets import secrets
 from supervisor import runtime, reload
 
@@ -64,8 +68,11 @@ MQTT_RX_TIMEOUT_SEC = const(10)
 MQTT_KEEP_ALIVE_MARGIN_SEC = const(20)
 FORCE_CAL_DISABLED = const(-1)
 TZ_OFFSET_PACIFIC = const(-8)
+SCHEDULER_TOLERANCE_DIVISOR = const(4)
+PRESSURE_HYSTERESIS_MBAR = const(2)
 MAGTAG_BATT_DXN_VOLTAGE = 4.20
 DEVICE_NAME = "Test"
+DEVICE_MODEL = "Magtag"
 SENSOR_NAME_BATTERY = "Batt Voltage"
 NUMBER_NAME_TEMP_OFFSET = "Temp Offset"
 NUMBER_NAME_PRESSURE = "Pressure"
@@ -76,12 +83,27 @@ BACKUP_NAME_TEMP_OFFSET = "temp offset"
 BACKUP_NAME_DISPLAY_TIME = "display"
 BACKUP_NAME_TIME_SYNC_TIME = "time sync"
 BACKUP_NAME_UPLOAD_TIME = "upload"
+BACKUP_NAME_UPLOADED_TIME = "uploaded"
+BACKUP_NAME_SAMPLE_TIME = "sample"
+TASK_SAMPLE = "sample"
+TASK_UPLOAD = "upload"
+TASK_TIME_SYNC = "time sync"
+TASK_DISPLAY = "display"
+ROLLUP_SENSOR_NAMES = (SENSOR_NAME_BATTERY,)
 TIME_FMT_STR = "%d:%02d:%02d"
 DATA_FMT_STR = "%d/%d/%d"
 
 # Globals
 state_light_sleep = runtime.serial_connected if not config["force_deep_sleep"] else False
 backup_ram = BackupRAM()
+rollups = {name: Rollup(backup_ram, name) for name in ROLLUP_SENSOR_NAMES}
+live_config = LiveConfig(backup_ram, config)
+sensor_settings = SensorSettings(backup_ram)
+sensor_settings.add_setting(BACKUP_NAME_PRESSURE, "ambient_pressure", PRESSURE_HYSTERESIS_MBAR)
+sensor_settings.add_setting(BACKUP_NAME_TEMP_OFFSET, "temperature_offset")
+# Last, so the forced recal runs with the new compensation
+sensor_settings.add_setting(BACKUP_NAME_CAL, "forced_recalibration_reference",
+                            disabled_value=FORCE_CAL_DISABLED)
 
 
 def c_to_f(temp_cels: float) -> float:
@@ -111,6 +133,8 @@ def mqtt_connected(client: MQTT.MQTT, user_data, flags, rc) -> None:
     client.subscribe(config["pressure_topic"])
     print(f"Subscribing to {config['cmd_topic']}...")
     client.subscribe(config["cmd_topic"])
+    print(f"Subscribing to {config['config_topic']}...")
+    client.subscribe(config["config_topic"])
 
 
 def mqtt_disconnected(client: MQTT.MQTT, user_data, rc) -> None:
@@ -132,8 +156,8 @@ def mqtt_message(client: MQTT.MQTT, topic: str, message) -> None:
             print(f"Ambient pressure value invalid\n{e}")
             return
 
-        print(f"Updating backup pressure to {pressure}")
-        backup_ram.set_element(BACKUP_NAME_PRESSURE, pressure)
+        print(f"Queueing pressure {pressure}")
+        sensor_settings.queue(BACKUP_NAME_PRESSURE, pressure)
 
     elif topic == config["cmd_topic"]:
         try:
@@ -144,16 +168,21 @@ def mqtt_message(client: MQTT.MQTT, topic: str, message) -> None:
 
         if NUMBER_NAME_CO2_REF in obj:
             cal_val = obj[NUMBER_NAME_CO2_REF]
-            print(f"Updating backup cal to {cal_val}")
-            backup_ram.set_element(BACKUP_NAME_CAL, cal_val)
+            print(f"Queueing cal {cal_val}")
+            sensor_settings.queue(BACKUP_NAME_CAL, cal_val)
 
         if NUMBER_NAME_TEMP_OFFSET in obj:
             temp_offset = obj[NUMBER_NAME_TEMP_OFFSET]
-            print(f"Updating backup temp offset to {temp_offset}")
-            backup_ram.set_element(BACKUP_NAME_TEMP_OFFSET, temp_offset)
+            print(f"Queueing temp offset {temp_offset}")
+            sensor_settings.queue(BACKUP_NAME_TEMP_OFFSET, temp_offset)
+
+    elif topic == config["config_topic"]:
+        live_config.stage(message)
 
 
 def main() -> None:
+    global state_light_sleep
+
     print("\nInitializing...")
     print(f"Time: {time.time()}")
 
@@ -168,6 +197,13 @@ def main() -> None:
         backup_ram.add_element(
             BACKUP_NAME_TEMP_OFFSET, "f", config["temp_offset_c"]
         )
+        live_config.add_elements()
+        for rollup in rollups.values():
+            rollup.add_elements()
+
+    # Apply config updates persisted from previous wakes
+    live_config.apply()
+    state_light_sleep = runtime.serial_connected if not config["force_deep_sleep"] else False
 
     red_led = digitalio.DigitalInOut(board.D13)
     red_led.switch_to_output(value=False)
@@ -196,15 +232,37 @@ def main() -> None:
     mqtt_client.on_disconnect = mqtt_disconnected
     mqtt_client.on_message = mqtt_message
     ntp = adafruit_ntp.NTP(socket_pool, tz_offset=TZ_OFFSET_PACIFIC)
-    network = MagtagNetwork(magtag, mqtt_client, ntp)
+    network = MagtagNetwork(magtag, mqtt_client, ntp, config["mqtt_publish_window"])
 
     def read_batt():
         volts = magtag.peripherals.battery
         return volts if volts < MAGTAG_BATT_DXN_VOLTAGE else 0
 
+    # Sensor readings taken once per wake, shared by the raw sensors and
+    # the upload window rollups so both report the same sample
+    sample_readers = {
+        SENSOR_NAME_BATTERY: read_batt,
+    }
+    samples = {}
+
     # Create home assistant sensors
     sensor_battery = HomeAssistantSensor(
-        SENSOR_NAME_BATTERY, read_batt, 2, DeviceClass.BATTERY, "V")
+        SENSOR_NAME_BATTERY, lambda: samples[SENSOR_NAME_BATTERY], 2, DeviceClass.BATTERY, "V")
+
+    # Create home assistant sensors for the upload window rollups
+    rollup_sensor_params = {
+        SENSOR_NAME_BATTERY: (2, DeviceClass.BATTERY, "V"),
+    }
+    rollup_sensors = []
+    for name, rollup in rollups.items():
+        precision, device_class, unit = rollup_sensor_params[name]
+        for stat in Rollup.STATS:
+            rollup_sensors.append(HomeAssistantSensor(
+                f"{name} {stat}",
+                lambda rollup=rollup, stat=stat: rollup.get_stat(stat),
+                precision,
+                device_class,
+                unit))
 
     # Create home assistant numbers
     number_temp_offset = HomeAssistantNumber(
@@ -232,8 +290,10 @@ def main() -> None:
         mode="box")
 
     # Create home assistant device
-    co2_device = HomeAssistantDevice(DEVICE_NAME, "Magtag", mqtt_client)
+    co2_device = HomeAssistantDevice(DEVICE_NAME, DEVICE_MODEL, mqtt_client)
     co2_device.add_sensor(sensor_battery)
+    for sensor in rollup_sensors:
+        co2_device.add_sensor(sensor)
     co2_device.add_number(number_temp_offset)
     co2_device.add_number(number_pressure)
     co2_device.add_number(number_co2_ref)
@@ -250,6 +310,30 @@ def main() -> None:
         backup_ram.add_element(BACKUP_NAME_DISPLAY_TIME, "I", now)
         backup_ram.add_element(BACKUP_NAME_TIME_SYNC_TIME, "I", now)
         backup_ram.add_element(BACKUP_NAME_UPLOAD_TIME, "I", now)
+        backup_ram.add_element(BACKUP_NAME_UPLOADED_TIME, "I", now)
+        backup_ram.add_element(BACKUP_NAME_SAMPLE_TIME, "I", now)
+
+    # Create wake scheduler
+    scheduler = WakeScheduler(backup_ram)
+
+    def add_scheduler_tasks():
+        sample_sec = config["light_sleep_sec"] if state_light_sleep else config["deep_sleep_sec"]
+        upload_sec = config["light_sleep_sec"] if state_light_sleep else config["upload_rate_sec"]
+        display_sec = config["display_refresh_rate_sec"] if state_light_sleep else sample_sec
+        tasks = (
+            (TASK_SAMPLE, BACKUP_NAME_SAMPLE_TIME, sample_sec),
+            (TASK_UPLOAD, BACKUP_NAME_UPLOAD_TIME, upload_sec),
+            (TASK_TIME_SYNC, BACKUP_NAME_TIME_SYNC_TIME, config["time_sync_rate_sec"]),
+            (TASK_DISPLAY, BACKUP_NAME_DISPLAY_TIME, display_sec),
+        )
+        for name, backup_name, period_sec in tasks:
+            scheduler.add_task(name, backup_name, period_sec, period_sec // SCHEDULER_TOLERANCE_DIVISOR)
+
+    add_scheduler_tasks()
+    if first_boot:
+        fixed_sleep_sec = config["light_sleep_sec"] if state_light_sleep else config["deep_sleep_sec"]
+        print(f"Scheduled wakes per day: {scheduler.wakes_per_day()}")
+        print(f"Fixed loop wakes per day: {WakeScheduler.SEC_PER_DAY // fixed_sleep_sec}")
 
     backup_ram.print_elements()
     print(f"Time: {time.time()}")
@@ -260,37 +344,45 @@ def main() -> None:
         print("Processing...")
         print(f"Time: {time.time()}")
 
-        # Load backup RAM data
-        display_time = backup_ram.get_element(BACKUP_NAME_DISPLAY_TIME)
-        time_sync_time = backup_ram.get_element(BACKUP_NAME_TIME_SYNC_TIME)
-        upload_time = backup_ram.get_element(BACKUP_NAME_UPLOAD_TIME)
-        current_pressure = backup_ram.get_element(BACKUP_NAME_PRESSURE)
-        current_temp_offset = backup_ram.get_element(BACKUP_NAME_TEMP_OFFSET)
-        current_cal_val = backup_ram.get_element(BACKUP_NAME_CAL)
+        # Check for due tasks. All tasks run on this wake are marked with the
+        # same wake time so they stay coalesced.
+        wake_time = time.time()
+        due_tasks = scheduler.due_tasks(wake_time)
+        print(f"Due tasks: {due_tasks}")
 
         print("Reading sensors...")
+
+        for name, read_fn in sample_readers.items():
+            samples[name] = read_fn()
+
+        # Accumulate upload window rollups first, so their stats include
+        # this sample whenever they are read or published
+        for name, rollup in rollups.items():
+            rollup.add(samples[name])
+
         sensor_data = co2_device.read_sensors(cache=True)
+        scheduler.mark_run(TASK_SAMPLE, wake_time)
         print(sensor_data)
         print(f"Time: {time.time()}")
 
         # Time sync
-        if (time.time() - time_sync_time) >= config["time_sync_rate_sec"] or first_boot:
+        if TASK_TIME_SYNC in due_tasks or first_boot:
             print("Time syncing...")
             network.connect()
             if network.ntp_time_sync():
-                backup_ram.set_element(BACKUP_NAME_TIME_SYNC_TIME, time.time())
+                scheduler.mark_run(TASK_TIME_SYNC, wake_time)
                 print(f"Time: {get_fmt_time()}")
                 print(f"Data: {get_fmt_date()}")
 
         # Upload data
-        if (time.time() - upload_time) >= config["upload_rate_sec"] or first_boot or state_light_sleep:
+        if TASK_UPLOAD in due_tasks or first_boot:
             print("Uploading data...")
             network.connect()
 
             # Send home assistant mqtt discovery
             try:
                 co2_device.send_discovery()
-            except (ValueError, RuntimeError, MQTT.MMQTTException) as e:
+            except (OSError, ValueError, RuntimeError, MQTT.MMQTTException) as e:
                 print(f"CO2 device MQTT discovery failure, rebooting\n{e}")
                 reload()
 
@@ -302,60 +394,64 @@ def main() -> None:
             print(f"Time: {time.time()}")
             try:
                 print("Publishing MQTT data...")
-                co2_device.publish_numbers()
-                co2_device.publish_sensors()
+                network.publish_pipelined(co2_device.publish_numbers, co2_device.publish_sensors)
+                for rollup in rollups.values():
+                    rollup.reset()
             except (OSError, ValueError, RuntimeError, MQTT.MMQTTException) as e:
                 print(f"MQTT Publish failure\n{e}")
                 if state_light_sleep:
                     network.recover()
 
-            backup_ram.set_element(BACKUP_NAME_UPLOAD_TIME, time.time())
+            scheduler.mark_run(TASK_UPLOAD, wake_time)
+            backup_ram.set_element(BACKUP_NAME_UPLOADED_TIME, time.time())
+
+        # Apply config updates received this cycle
+        changed_config = live_config.apply()
+        if changed_config:
+            add_scheduler_tasks()
+        if state_light_sleep and "light_sleep_sec" in changed_config:
+            network.set_keep_alive(config["light_sleep_sec"] + MQTT_KEEP_ALIVE_MARGIN_SEC)
 
         # Turn off network if in deep sleep mode
         if not state_light_sleep and network.is_connected():
             network.disconnect()
 
-        # Perform forced recal if received new cal value
-        expected_cal_val = backup_ram.get_element(BACKUP_NAME_CAL)
-        if expected_cal_val != FORCE_CAL_DISABLED and expected_cal_val != current_cal_val:
-            print(f"Updating cal reference from {current_cal_val} to {expected_cal_val}")
-
-        # Update temp offset if received a new value
-        expected_temp_offset = backup_ram.get_element(BACKUP_NAME_TEMP_OFFSET)
-        if expected_temp_offset != current_temp_offset:
-            print(f"Updating temp offset from {current_temp_offset} to {expected_temp_offset}")
-
-        # Update pressure if received a new value
-        expected_pressure = backup_ram.get_element(BACKUP_NAME_PRESSURE)
-        if expected_pressure != current_pressure:
-            print(f"Updating pressure from {current_pressure} to {expected_pressure}")
+        # Store sensor setting commands received this cycle. The sensors
+        # have been read, so this is the safe point to write new settings.
+        # TODO: Set sensor_settings.apply_hook = SensorSettings.sensor_hook(scd30)
+        # once the SCD30 is created
+        sensor_settings.flush()
 
         # Update display
-        if ((time.time() - display_time) >= config["display_refresh_rate_sec"]) or not state_light_sleep:
+        if TASK_DISPLAY in due_tasks or first_boot:
             print(f"Time: {time.time()}")
             print("Updating display...")
             now = get_fmt_time()
-            uploaded_time = get_fmt_time(backup_ram.get_element(BACKUP_NAME_UPLOAD_TIME))
+            uploaded_time = get_fmt_time(backup_ram.get_element(BACKUP_NAME_UPLOADED_TIME))
             display.update_batt(sensor_data[SENSOR_NAME_BATTERY])
             display.update_datetime(f"Updated: {now}. Uploaded: {uploaded_time}")
             display.refresh(delay=False)
-            backup_ram.set_element(BACKUP_NAME_DISPLAY_TIME, time.time())
+            scheduler.mark_run(TASK_DISPLAY, wake_time)
 
         print(f"Time: {time.time()}")
         print("")
 
-        print("Sleeping...")
+        first_boot = False
+        sleep_sec = scheduler.sleep_time(time.time())
+        print(f"Sleeping for {sleep_sec} sec...")
         print("")
+        next_light_sleep = runtime.serial_connected if not config["force_deep_sleep"] else False
         if state_light_sleep:
-            if state_light_sleep != runtime.serial_connected:
-                reload()  # State transition, reboot into deep sleep state
+            if not next_light_sleep:
+                # State transition, deep sleep already restarts on wake so
+                # there is no need to reload first
+                if network.is_connected():
+                    network.disconnect()
+                magtag.exit_and_deep_sleep(sleep_sec)
             else:
-                magtag.enter_light_sleep(config["light_sleep_sec"])
+                magtag.enter_light_sleep(sleep_sec)
         else:
-            if state_light_sleep != runtime.serial_connected and config["force_deep_sleep"] is False:
+            if next_light_sleep:
                 reload()  # State transition, reboot into light sleep state
             else:
-                magtag.exit_and_deep_sleep(config["deep_sleep_sec"])
-
-
-main()
+                magtag.exit_and_deep_sleep(sleep_sec)
@@ -7,6 +7,8 @@ config = {
     "ambient_pressure": 1000,
     "temp_offset_c": 1.0,
     "force_deep_sleep": False,
+    "mqtt_publish_window": 8,
     "pressure_topic": "homeassistant/aranet/pressure",
-    "cmd_topic": "homeassistant/number/generic-device/cmd"
+    "cmd_topic": "homeassistant/number/generic-device/cmd",
+    "config_topic": "homeassistant/magtag/config"
 }
@@ -0,0 +1,103 @@
+import json
+
+from memory import BackupRAM
+
+
+class LiveConfig():
+    # Constants
+    BACKUP_NAME_PREFIX = "cfg "
+
+    # config key: (python type, backup RAM data type, min value, max value)
+    SCHEMA = {
+        "light_sleep_sec": (int, "I", 1, 3600),
+        "deep_sleep_sec": (int, "I", 10, 86400),
+        "display_refresh_rate_sec": (int, "I", 10, 86400),
+        "upload_rate_sec": (int, "I", 10, 86400),
+        "time_sync_rate_sec": (int, "I", 60, 604800),
+        "force_deep_sleep": (bool, "B", 0, 1),
+    }
+
+    def __init__(self, backup_ram: BackupRAM, config: dict) -> None:
+        self.backup_ram = backup_ram
+        self.config = config
+
+    def _backup_name(self, key: str) -> str:
+        return self.BACKUP_NAME_PREFIX + key
+
+    def _validate(self, key: str, value):
+        if key not in self.SCHEMA:
+            raise ValueError(f"Unknown config key: {key}")
+
+        value_type, _, min_value, max_value = self.SCHEMA[key]
+        if value_type is bool:
+            if not isinstance(value, bool):
+                raise ValueError(f"Config {key} must be a bool: {value}")
+        elif isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f"Config {key} must be a number: {value}")
+
+        # Range check first, this also rejects inf and nan before int() sees them
+        if not min_value <= value <= max_value:
+            raise ValueError(f"Config {key} out of range [{min_value}, {max_value}]: {value}")
+
+        if value != int(value):
+            raise ValueError(f"Config {key} must be an integer: {value}")
+
+        return value_type(value)
+
+    def add_elements(self) -> None:
+        """Add backup RAM elements for every live config key, seeded with the
+        current (static) config values. Only call on first boot.
+        """
+        for key, (_, data_type, _, _) in self.SCHEMA.items():
+            self.backup_ram.add_element(
+                self._backup_name(key), data_type, int(self.config[key]))
+
+    def stage(self, message: str) -> dict:
+        """Diff a JSON config message against the persisted config and store
+        any valid changes in backup RAM. Changes are not applied to the config
+        until `apply()` is called.
+        :param str message: JSON object of config keys and new values
+        :return: dict of the changed config keys and their new values
+        """
+        try:
+            obj = json.loads(message)
+        except ValueError as e:
+            print(f"Config message invalid\n{e}")
+            return {}
+
+        if not isinstance(obj, dict):
+            print(f"Config message must be a JSON object: {message}")
+            return {}
+
+        changes = {}
+        for key, value in obj.items():
+            try:
+                value = self._validate(key, value)
+            except ValueError as e:
+                print(e)
+                continue
+
+            name = self._backup_name(key)
+            if self.SCHEMA[key][0](self.backup_ram.get_element(name)) != value:
+                changes[key] = value
+
+        for key, value in changes.items():
+            print(f"Staging config {key}: {value}")
+            self.backup_ram.set_element(self._backup_name(key), int(value))
+
+        return changes
+
+    def apply(self) -> dict:
+        """Apply the persisted config values from backup RAM to the config
+        in place.
+        :return: dict of config keys that changed, mapped to their old values
+        """
+        changed = {}
+        for key, (value_type, _, _, _) in self.SCHEMA.items():
+            value = value_type(self.backup_ram.get_element(self._backup_name(key)))
+            if value != self.config[key]:
+                print(f"Applying config {key}: {self.config[key]} -> {value}")
+                changed[key] = self.config[key]
+                self.config[key] = value
+
+        return changed
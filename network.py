@@ -2,10 +2,12 @@ import adafruit_minimqtt.adafruit_minimqtt as MQTT
 import adafruit_ntp
 import ipaddress
 import rtc
+import struct
 import time
 import wifi
 
 from adafruit_magtag.magtag import MagTag
+from adafruit_ticks import ticks_ms
 from supervisor import reload
 
 
@@ -13,11 +15,30 @@ class MagtagNetwork():
     # Constants
     CONNECT_ATTEMPTS_WIFI = 10
     GOOGLE_IP_ADDRESS = ipaddress.ip_address("8.8.4.4")
+    MQTT_PUBLISH = 0x30
+    MQTT_PUBLISH_DUP = 0x08
+    MQTT_PUBLISH_QOS_1 = 0x02
+    MQTT_PUBACK = 0x40
+    MQTT_PINGRESP = 0xD0
+    PUBLISH_WINDOW = 8
+    PUBLISH_TIMEOUT_SEC = 10
+    PUBLISH_RETRY_SEC = 2
+    PUBLISH_DRAIN_TIMEOUT_SEC = 0.1
 
-    def __init__(self, magtag: MagTag, mqtt_client: MQTT.MQTT, ntp: adafruit_ntp.NTP = None) -> None:
+    def __init__(self,
+                 magtag: MagTag,
+                 mqtt_client: MQTT.MQTT,
+                 ntp: adafruit_ntp.NTP = None,
+                 publish_window: int = PUBLISH_WINDOW) -> None:
         self.magtag = magtag
         self.mqtt_client = mqtt_client
         self.ntp = ntp
+        if publish_window < 1:
+            raise ValueError(f"Publish window must be at least 1: {publish_window}")
+        self.publish_window = publish_window
+
+        # Optional callback with the ack latency in seconds of each pipelined publish
+        self.on_publish_ack = None
 
     def _mqtt_connect(self, force: bool = False) -> None:
         print("Connecting MQTT client...")
@@ -47,6 +68,145 @@ class MagtagNetwork():
         else:
             print("MQTT is already disconnected")
 
+    def _next_packet_id(self) -> int:
+        # Share the client's packet ID counter so IDs don't collide with its own
+        pid = self.mqtt_client._pid + 1 if self.mqtt_client._pid < 0xFFFF else 1
+        self.mqtt_client._pid = pid
+        return pid
+
+    def _build_publish_packet(self, topic: str, msg, retain: bool, pid: int) -> bytearray:
+        if isinstance(msg, (int, float)):
+            msg = str(msg).encode("ascii")
+        elif isinstance(msg, str):
+            msg = msg.encode("utf-8")
+        topic = topic.encode("utf-8")
+
+        packet = bytearray([self.MQTT_PUBLISH | self.MQTT_PUBLISH_QOS_1 | retain])
+        remaining_length = 2 + len(topic) + 2 + len(msg)
+        while True:
+            encoded_byte = remaining_length & 0x7F
+            remaining_length >>= 7
+            if remaining_length:
+                encoded_byte |= 0x80
+            packet.append(encoded_byte)
+            if not remaining_length:
+                break
+
+        packet.extend(struct.pack(">H", len(topic)))
+        packet.extend(topic)
+        packet.extend(struct.pack(">H", pid))
+        packet.extend(msg)
+        return packet
+
+    def _send_packet(self, packet: bytearray) -> None:
+        if hasattr(self.mqtt_client, "_send_bytes"):
+            self.mqtt_client._send_bytes(packet)
+        else:
+            self.mqtt_client._sock.send(packet)
+        # Sending counts as activity for the client's keep alive pings
+        self.mqtt_client._last_msg_sent_timestamp = ticks_ms()
+
+    def _check_publish(self, topic: str, msg) -> bytes:
+        # Same checks as MQTT.publish, which queued messages bypass
+        self.mqtt_client._connected()
+        self.mqtt_client._valid_topic(topic)
+        if "+" in topic or "#" in topic:
+            raise ValueError("Publish topic can not contain wildcards.")
+        if msg is None:
+            raise ValueError("Message can not be None.")
+        if isinstance(msg, (int, float)):
+            msg = str(msg).encode("ascii")
+        elif isinstance(msg, str):
+            msg = msg.encode("utf-8")
+        elif not isinstance(msg, bytes):
+            raise ValueError("Invalid message data type.")
+        if len(msg) > self.mqtt_client._msg_size_lim:
+            raise ValueError(
+                f"Message size larger than configured limit {self.mqtt_client._msg_size_lim} bytes.")
+        return msg
+
+    def _read_puback_id(self) -> int:
+        self.mqtt_client._sock_exact_recv(1)
+        pid_bytes = self.mqtt_client._sock_exact_recv(2)
+        return pid_bytes[0] << 8 | pid_bytes[1]
+
+    def _skip_packet_body(self) -> None:
+        # Read and discard the rest of a packet the client returned unread
+        remaining_length = 0
+        shift = 0
+        while True:
+            encoded_byte = self.mqtt_client._sock_exact_recv(1)[0]
+            remaining_length |= (encoded_byte & 0x7F) << shift
+            if not encoded_byte & 0x80:
+                break
+            shift += 7
+
+        if remaining_length:
+            self.mqtt_client._sock_exact_recv(remaining_length)
+
+    def _publish_window(self, messages: list) -> None:
+        pending = list(reversed(messages))
+        in_flight = {}
+        round_trips = 0
+        retries = 0
+        deadline = time.monotonic() + self.PUBLISH_TIMEOUT_SEC
+
+        while pending or in_flight:
+            # Fill the in-flight window
+            sent = False
+            while pending and len(in_flight) < self.publish_window:
+                topic, msg, retain = pending.pop()
+                pid = self._next_packet_id()
+                packet = self._build_publish_packet(topic, msg, retain, pid)
+                self._send_packet(packet)
+                now = time.monotonic()
+                in_flight[pid] = (topic, packet, now, now)
+                sent = True
+            if sent:
+                round_trips += 1
+
+            # Drain acknowledgements in one pass. PUBLISH and PINGRESP packets
+            # are handled by the client, anything else is skipped.
+            while in_flight:
+                op = self.mqtt_client._wait_for_msg(timeout=self.PUBLISH_DRAIN_TIMEOUT_SEC)
+                if op is None:
+                    break
+                if op == self.MQTT_PUBACK:
+                    pid = self._read_puback_id()
+                    if pid not in in_flight:
+                        continue
+                    topic, _, _, first_sent_time = in_flight.pop(pid)
+                    if self.on_publish_ack is not None:
+                        self.on_publish_ack(time.monotonic() - first_sent_time)
+                    if self.mqtt_client.on_publish is not None:
+                        self.mqtt_client.on_publish(self.mqtt_client, self.mqtt_client.user_data, topic, pid)
+                elif op & 0xF0 not in (self.MQTT_PUBLISH, self.MQTT_PINGRESP):
+                    self._skip_packet_body()
+
+            now = time.monotonic()
+            if now >= deadline:
+                break
+
+            # Retransmit anything unacknowledged for too long
+            retransmitted = False
+            for pid, (topic, packet, sent_time, first_sent_time) in list(in_flight.items()):
+                if now - sent_time >= self.PUBLISH_RETRY_SEC:
+                    packet[0] |= self.MQTT_PUBLISH_DUP
+                    self._send_packet(packet)
+                    in_flight[pid] = (topic, packet, now, first_sent_time)
+                    retries += 1
+                    retransmitted = True
+            if retransmitted:
+                round_trips += 1
+
+        failed = len(in_flight) + len(pending)
+        acked = len(messages) - failed
+        print(f"Published {acked} of {len(messages)} messages, "
+              f"{max(0, acked - round_trips)} round trips saved, {retries} retries")
+
+        if failed:
+            raise MQTT.MMQTTException(f"{failed} messages were not acknowledged")
+
     def _wifi_connect(self) -> None:
         print("Connecting wifi...")
 
@@ -90,6 +250,18 @@ class MagtagNetwork():
             if recover:
                 self.recover()
 
+    def set_keep_alive(self, keep_alive_sec: int) -> None:
+        if self.mqtt_client.keep_alive == keep_alive_sec:
+            return
+
+        print(f"Updating MQTT keep alive to {keep_alive_sec} sec")
+        self.mqtt_client.keep_alive = keep_alive_sec
+
+        # Keep alive is negotiated on connect, so reconnect to apply it
+        if self.mqtt_client.is_connected():
+            self._mqtt_disconnect()
+            self._mqtt_connect()
+
     def recover(self) -> None:
         print("Recovering network devices...")
 
@@ -108,6 +280,32 @@ class MagtagNetwork():
         self._mqtt_disconnect(force=True)
         self._mqtt_connect(force=True)
 
+    def publish_pipelined(self, *publish_funcs) -> None:
+        """Run the publish functions with QoS 1 publishes queued instead of
+        sent, then send them with up to `publish_window` messages in flight
+        at once rather than waiting a round trip for each PUBACK.
+        Unacknowledged messages are retried until PUBLISH_TIMEOUT_SEC.
+        :param publish_funcs: Functions that publish via the MQTT client
+        """
+        messages = []
+        publish = self.mqtt_client.publish
+
+        def queue_publish(topic, msg, retain=False, qos=0):
+            if qos != 1:
+                publish(topic, msg, retain, qos)
+            else:
+                messages.append((topic, self._check_publish(topic, msg), retain))
+
+        self.mqtt_client.publish = queue_publish
+        try:
+            for publish_func in publish_funcs:
+                publish_func()
+        finally:
+            self.mqtt_client.publish = publish
+
+        if messages:
+            self._publish_window(messages)
+
     def ntp_time_sync(self) -> bool:
         if not self.ntp:
             print("NTP time sync failed, no ntp object created.")
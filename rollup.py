@@ -0,0 +1,135 @@
+from memory import BackupRAM
+
+
+class Rollup():
+    """
+    Incremental min/max/mean and streaming quantile of a sensor over an
+    upload window, persisted in backup RAM so it survives deep sleep.
+    The quantile uses the P-square algorithm, which keeps 5 markers instead
+    of the samples themselves.
+    """
+    # Constants
+    QUANTILE = 0.95
+    NUM_MARKERS = 5
+    STAT_MIN = "Min"
+    STAT_MAX = "Max"
+    STAT_MEAN = "Mean"
+    STAT_QUANTILE = "P95"
+    STATS = (STAT_MIN, STAT_MAX, STAT_MEAN, STAT_QUANTILE)
+
+    def __init__(self, backup_ram: BackupRAM, name: str) -> None:
+        self.backup_ram = backup_ram
+        self.name = name
+        self.marker_increments = (0, self.QUANTILE / 2, self.QUANTILE, (1 + self.QUANTILE) / 2, 1)
+
+    def _backup_name(self, field: str) -> str:
+        return f"{self.name} {field}"
+
+    def _get(self, field: str):
+        return self.backup_ram.get_element(self._backup_name(field))
+
+    def _set(self, field: str, value) -> None:
+        self.backup_ram.set_element(self._backup_name(field), value)
+
+    def add_elements(self) -> None:
+        """Add backup RAM elements for this rollup. Only call on first boot."""
+        self.backup_ram.add_element(self._backup_name("n"), "I", 0)
+        for field in ("min", "max", "mean"):
+            self.backup_ram.add_element(self._backup_name(field), "f", 0.0)
+        for i in range(self.NUM_MARKERS):
+            self.backup_ram.add_element(self._backup_name(f"q{i}"), "f", 0.0)
+        for i in range(1, self.NUM_MARKERS - 1):
+            self.backup_ram.add_element(self._backup_name(f"n{i}"), "I", i)
+
+    def reset(self) -> None:
+        self._set("n", 0)
+        for i in range(1, self.NUM_MARKERS - 1):
+            self._set(f"n{i}", i)
+
+    def count(self) -> int:
+        return self._get("n")
+
+    def add(self, value: float) -> None:
+        if value is None:
+            return
+
+        count = self._get("n")
+        if count == 0:
+            self._set("min", value)
+            self._set("max", value)
+            self._set("mean", value)
+        else:
+            if value < self._get("min"):
+                self._set("min", value)
+            if value > self._get("max"):
+                self._set("max", value)
+            mean = self._get("mean")
+            self._set("mean", mean + (value - mean) / (count + 1))
+
+        if count < self.NUM_MARKERS:
+            # Collect the first samples as the initial marker heights
+            self._set(f"q{count}", value)
+            if count == self.NUM_MARKERS - 1:
+                heights = sorted(self._get(f"q{i}") for i in range(self.NUM_MARKERS))
+                for i, height in enumerate(heights):
+                    self._set(f"q{i}", height)
+        else:
+            self._update_markers(count, value)
+
+        self._set("n", count + 1)
+
+    def _update_markers(self, count: int, value: float) -> None:
+        q = [self._get(f"q{i}") for i in range(self.NUM_MARKERS)]
+        n = [0] + [self._get(f"n{i}") for i in range(1, self.NUM_MARKERS - 1)] + [count - 1]
+
+        # Find the cell the new sample falls into, extending the extremes
+        if value < q[0]:
+            q[0] = value
+            cell = 0
+        elif value >= q[4]:
+            q[4] = value
+            cell = 3
+        else:
+            cell = 0
+            while value >= q[cell + 1]:
+                cell += 1
+
+        for i in range(cell + 1, self.NUM_MARKERS):
+            n[i] += 1
+
+        # Move the middle markers towards their desired positions
+        for i in range(1, self.NUM_MARKERS - 1):
+            offset = count * self.marker_increments[i] - n[i]
+            if (offset >= 1 and n[i + 1] - n[i] > 1) or (offset <= -1 and n[i - 1] - n[i] < -1):
+                step = 1 if offset > 0 else -1
+                height = q[i] + step / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + step) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+                    (n[i + 1] - n[i] - step) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + step * (q[i + step] - q[i]) / (n[i + step] - n[i])
+                q[i] = height
+                n[i] += step
+
+        for i in range(self.NUM_MARKERS):
+            self._set(f"q{i}", q[i])
+        for i in range(1, self.NUM_MARKERS - 1):
+            self._set(f"n{i}", n[i])
+
+    def get_stat(self, stat: str) -> float:
+        count = self._get("n")
+        if count == 0:
+            return None
+
+        if stat == self.STAT_MIN:
+            return self._get("min")
+        if stat == self.STAT_MAX:
+            return self._get("max")
+        if stat == self.STAT_MEAN:
+            return self._get("mean")
+        if stat == self.STAT_QUANTILE:
+            if count < self.NUM_MARKERS:
+                samples = sorted(self._get(f"q{i}") for i in range(count))
+                return samples[round(self.QUANTILE * (count - 1))]
+            return self._get("q2")
+
+        raise ValueError(f"Unknown rollup stat: {stat}")
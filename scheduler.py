@@ -0,0 +1,101 @@
+from memory import BackupRAM
+
+
+class WakeScheduler():
+    """
+    Schedules wakes at the earliest task deadline instead of a fixed sleep.
+    Each periodic task may run up to `tolerance_sec` before its deadline, so
+    tasks whose windows overlap the wake time are coalesced into one wake.
+    Last run times are kept in backup RAM elements so the schedule survives
+    deep sleep. All times are passed in explicitly, so the scheduler can be
+    driven by a virtual clock.
+    """
+    # Constants
+    SEC_PER_DAY = 86400
+
+    def __init__(self, backup_ram: BackupRAM) -> None:
+        self.backup_ram = backup_ram
+        self.tasks = {}
+
+    def add_task(self, name: str, backup_name: str, period_sec: int, tolerance_sec: int = 0) -> None:
+        """Register (or re-register) a periodic task.
+        :param str name: Task name
+        :param str backup_name: Backup RAM element holding the task's last run time
+        :param int period_sec: Time between task runs
+        :param int tolerance_sec: How early the task may run to share a wake
+        """
+        self.tasks[name] = (backup_name, period_sec, min(tolerance_sec, period_sec))
+
+    def _last_runs(self) -> dict:
+        return {name: self.backup_ram.get_element(task[0]) for name, task in self.tasks.items()}
+
+    def _due(self, last_runs: dict, now: int) -> list:
+        due = []
+        for name, (_, period_sec, tolerance_sec) in self.tasks.items():
+            if now >= last_runs[name] + period_sec - tolerance_sec:
+                due.append(name)
+        return due
+
+    def _next_run_time(self, last_run: int, period_sec: int, tolerance_sec: int, now: int) -> int:
+        # Early runs keep the task anchored to its deadline so its cadence
+        # doesn't drift, late or forced runs restart it from now.
+        deadline = last_run + period_sec
+        if deadline - tolerance_sec <= now < deadline:
+            return deadline
+        return now
+
+    def _next_wake(self, last_runs: dict, now: int) -> int:
+        # A task still overdue at sleep time wasn't run or failed. It stays
+        # due, but counts from now so it can't force back to back wakes and
+        # is retried on the next wake instead.
+        next_wake = None
+        for name, (_, period_sec, _) in self.tasks.items():
+            deadline = last_runs[name] + period_sec
+            if deadline <= now:
+                deadline = now + period_sec
+            if next_wake is None or deadline < next_wake:
+                next_wake = deadline
+        return next_wake
+
+    def due_tasks(self, now: int) -> list:
+        return self._due(self._last_runs(), now)
+
+    def mark_run(self, name: str, now: int) -> None:
+        backup_name, period_sec, tolerance_sec = self.tasks[name]
+        last_run = self.backup_ram.get_element(backup_name)
+        self.backup_ram.set_element(
+            backup_name, self._next_run_time(last_run, period_sec, tolerance_sec, now))
+
+    def next_wake(self, now: int) -> int:
+        """Get the time of the next wake, which is the earliest task deadline.
+        Tasks whose tolerance windows have opened by then run on the same wake.
+        """
+        return self._next_wake(self._last_runs(), now)
+
+    def sleep_time(self, now: int) -> int:
+        return max(1, self.next_wake(now) - now)
+
+    def simulate(self, duration_sec: int, start: int = 0, failing: tuple = ()) -> int:
+        """Count the wakes needed over `duration_sec` on a virtual clock,
+        starting with every task freshly run. Backup RAM is not modified.
+        :param tuple failing: Names of tasks that always fail, so are never marked run
+        """
+        last_runs = {name: start for name in self.tasks}
+        now = start
+        wakes = 0
+        while True:
+            now = self._next_wake(last_runs, now)
+            if now > start + duration_sec:
+                break
+
+            wakes += 1
+            for name in self._due(last_runs, now):
+                if name in failing:
+                    continue
+                _, period_sec, tolerance_sec = self.tasks[name]
+                last_runs[name] = self._next_run_time(last_runs[name], period_sec, tolerance_sec, now)
+
+        return wakes
+
+    def wakes_per_day(self) -> int:
+        return self.simulate(self.SEC_PER_DAY)
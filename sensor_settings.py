@@ -0,0 +1,85 @@
+from memory import BackupRAM
+
+
+class SensorSettings():
+    """
+    Coalesced, deferred writes of SCD30 measurement settings.
+    MQTT commands are queued rather than written straight to backup RAM, so
+    repeated commands for a setting within a cycle collapse into the latest
+    value. `flush()` then stores the changed values once, at a point in the
+    cycle chosen by the caller, and hands them to the apply hook in one
+    batch. Changes within a setting's hysteresis are dropped.
+    """
+
+    def __init__(self, backup_ram: BackupRAM) -> None:
+        self.backup_ram = backup_ram
+        self.settings = {}
+        self.queued = {}
+
+        # Optional callback with the changed settings, as a dict of scd30
+        # attribute: new value in the order the settings were added
+        self.apply_hook = None
+
+    def add_setting(self,
+                    backup_name: str,
+                    attribute: str,
+                    hysteresis: float = 0,
+                    disabled_value=None) -> None:
+        """Register a setting. Settings are applied in the order added.
+        :param str backup_name: Backup RAM element holding the setting
+        :param str attribute: SCD30 attribute the setting is written to
+        :param hysteresis: Smallest change that is stored
+        :param disabled_value: Value that is stored but never applied
+        """
+        self.settings[backup_name] = (attribute, hysteresis, disabled_value)
+
+    def queue(self, backup_name: str, value) -> None:
+        if backup_name in self.queued:
+            print(f"Coalescing {backup_name} {self.queued[backup_name]} -> {value}")
+        self.queued[backup_name] = value
+
+    def flush(self) -> dict:
+        """Store the queued values that changed by at least their hysteresis
+        and pass them to the apply hook.
+        :return: dict of the changed backup names and their new values
+        """
+        changes = {}
+        for backup_name, value in self.queued.items():
+            current = self.backup_ram.get_element(backup_name)
+            if value == current:
+                continue
+            if abs(value - current) < self.settings[backup_name][1]:
+                print(f"Ignoring {backup_name} change within hysteresis: {current} -> {value}")
+                continue
+
+            print(f"Updating {backup_name} from {current} to {value}")
+            self.backup_ram.set_element(backup_name, value)
+            changes[backup_name] = value
+        self.queued.clear()
+
+        sensor_changes = self._sensor_changes(changes)
+        if sensor_changes and self.apply_hook is not None:
+            self.apply_hook(sensor_changes)
+
+        return changes
+
+    def _sensor_changes(self, changes: dict) -> dict:
+        sensor_changes = {}
+        for backup_name, (attribute, _, disabled_value) in self.settings.items():
+            if backup_name in changes and changes[backup_name] != disabled_value:
+                sensor_changes[attribute] = changes[backup_name]
+        return sensor_changes
+
+    @staticmethod
+    def sensor_hook(sensor):
+        """Make an apply hook that writes each change to a sensor attribute.
+        :param sensor: adafruit_scd30.SCD30
+        """
+        def apply(sensor_changes):
+            for attribute, value in sensor_changes.items():
+                try:
+                    setattr(sensor, attribute, value)
+                except (OSError, ValueError, RuntimeError) as e:
+                    print(f"Failed to set sensor {attribute}\n{e}")
+
+        return apply
@@ -0,0 +1,14 @@
+import os
+import sys
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# Stand-ins for the CircuitPython modules imported by the device code
+sys.modules.setdefault("alarm", types.SimpleNamespace(sleep_memory=bytearray(8192)))
+sys.modules.setdefault("micropython", types.SimpleNamespace(const=lambda value: value))
+sys.modules.setdefault("rtc", types.SimpleNamespace(RTC=None))
+sys.modules.setdefault("supervisor", types.SimpleNamespace(reload=None))
+sys.modules.setdefault("wifi", types.SimpleNamespace(radio=None))
+sys.modules.setdefault("adafruit_magtag", types.SimpleNamespace())
+sys.modules.setdefault("adafruit_magtag.magtag", types.SimpleNamespace(MagTag=object))
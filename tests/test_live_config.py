@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+from live_config import LiveConfig
+from memory import BackupRAM
+
+
+@pytest.fixture
+def config():
+    return {
+        "light_sleep_sec": 60,
+        "deep_sleep_sec": 120,
+        "display_refresh_rate_sec": 120,
+        "upload_rate_sec": 600,
+        "time_sync_rate_sec": 3600,
+        "force_deep_sleep": False,
+    }
+
+
+@pytest.fixture
+def live_config(config):
+    live_config = LiveConfig(BackupRAM(reset=True), config)
+    live_config.add_elements()
+    return live_config
+
+
+@pytest.mark.parametrize("message", [
+    '{"unknown_key": 10}',
+    '{"upload_rate_sec": true}',
+    '{"force_deep_sleep": 1}',
+    '{"upload_rate_sec": 900.5}',
+    '{"upload_rate_sec": "900"}',
+    '{"upload_rate_sec": 5}',
+    '{"upload_rate_sec": 1e400}',
+    '{"upload_rate_sec": -1e400}',
+    '{"upload_rate_sec": Infinity}',
+    '{"upload_rate_sec": NaN}',
+    '[1, 2]',
+    '"upload_rate_sec"',
+    'not json',
+])
+def test_invalid_messages_are_ignored(live_config, message):
+    assert live_config.stage(message) == {}
+    assert live_config.apply() == {}
+
+
+def test_whole_floats_are_accepted(live_config):
+    assert live_config.stage('{"upload_rate_sec": 900.0}') == {"upload_rate_sec": 900}
+
+
+def test_valid_keys_are_staged_alongside_invalid_ones(live_config):
+    message = json.dumps({"upload_rate_sec": 900, "deep_sleep_sec": 1})
+    assert live_config.stage(message) == {"upload_rate_sec": 900}
+
+
+def test_stage_diffs_against_staged_values(live_config, config):
+    message = json.dumps({"upload_rate_sec": 900, "force_deep_sleep": True})
+    assert live_config.stage(message) == {"upload_rate_sec": 900, "force_deep_sleep": True}
+
+    # Already staged, so a repeated message is not a change
+    assert live_config.stage(message) == {}
+    assert live_config.stage(json.dumps({"upload_rate_sec": 600})) == {"upload_rate_sec": 600}
+
+    # Staging doesn't touch the config until it is applied
+    assert config["upload_rate_sec"] == 600
+
+
+def test_apply_returns_old_values(live_config, config):
+    live_config.stage(json.dumps({"upload_rate_sec": 900, "force_deep_sleep": True}))
+
+    assert live_config.apply() == {"upload_rate_sec": 600, "force_deep_sleep": False}
+    assert config["upload_rate_sec"] == 900
+    assert config["force_deep_sleep"] is True
+    assert live_config.apply() == {}
+
+
+def test_apply_restores_persisted_values(live_config, config):
+    live_config.stage(json.dumps({"light_sleep_sec": 30}))
+
+    # A fresh config after a deep sleep restart picks up the persisted value
+    fresh_config = dict(config)
+    assert LiveConfig(live_config.backup_ram, fresh_config).apply() == {"light_sleep_sec": 60}
+    assert fresh_config["light_sleep_sec"] == 30
@@ -0,0 +1,162 @@
+import socket
+import types
+
+import pytest
+
+MQTT = pytest.importorskip("adafruit_minimqtt.adafruit_minimqtt")
+pytest.importorskip("adafruit_ntp")
+
+from network import MagtagNetwork  # noqa: E402
+
+PUBACK = 0x40
+
+
+class FakeBrokerSocket():
+    """Acknowledges every QoS 1 PUBLISH it is sent, except packet IDs in
+    `drop`, which are dropped once, or all of them with `ack=False`.
+    """
+
+    def __init__(self, ack: bool = True) -> None:
+        self.ack = ack
+        self.drop = set()
+        self.sent = []
+        self.rx = bytearray()
+
+    def send(self, data) -> int:
+        packet = bytes(data)
+        self.sent.append(packet)
+        qos_1_publish = MagtagNetwork.MQTT_PUBLISH | MagtagNetwork.MQTT_PUBLISH_QOS_1
+        if packet[0] & 0xF6 != qos_1_publish:
+            return len(packet)
+
+        pid = _publish_packet_id(packet)
+        if pid in self.drop:
+            self.drop.discard(pid)
+        elif self.ack:
+            self.rx.extend(bytes([PUBACK, 0x02, pid >> 8, pid & 0xFF]))
+        return len(packet)
+
+    def recv_into(self, buffer, size: int) -> int:
+        if not self.rx:
+            raise socket.timeout()
+        size = min(size, len(self.rx))
+        buffer[:size] = self.rx[:size]
+        del self.rx[:size]
+        return size
+
+
+def _publish_packet_id(packet: bytes) -> int:
+    index = 1
+    while packet[index] & 0x80:
+        index += 1
+    topic_len = packet[index + 1] << 8 | packet[index + 2]
+    pid_index = index + 3 + topic_len
+    return packet[pid_index] << 8 | packet[pid_index + 1]
+
+
+@pytest.fixture
+def broker():
+    return FakeBrokerSocket()
+
+
+@pytest.fixture
+def client(broker):
+    client = MQTT.MQTT(broker="localhost", socket_pool=socket, is_ssl=False)
+    client._sock = broker
+    client._is_connected = True
+    return client
+
+
+@pytest.fixture
+def network(client):
+    return MagtagNetwork(types.SimpleNamespace(), client, publish_window=2)
+
+
+def publish_all(client, count, qos=1):
+    def publish():
+        for i in range(count):
+            client.publish(f"magtag/sensor/{i}", i, qos=qos)
+    return publish
+
+
+def test_publish_window_must_be_positive(client):
+    with pytest.raises(ValueError):
+        MagtagNetwork(types.SimpleNamespace(), client, publish_window=0)
+
+
+def test_build_publish_packet(network):
+    assert network._build_publish_packet("a/b", "1.5", True, 7) == \
+        bytearray(b"\x33\x0a\x00\x03a/b\x00\x071.5")
+
+    # Remaining length over 127 bytes takes two bytes
+    packet = network._build_publish_packet("a", b"x" * 200, False, 1)
+    assert packet[:3] == bytearray([0x32, 0xCD, 0x01])
+    assert len(packet) == 3 + 205
+
+
+def test_publish_pipelined_matches_pubacks(network, client, broker):
+    acks = []
+    published = []
+    network.on_publish_ack = acks.append
+    client.on_publish = lambda client, user_data, topic, pid: published.append((topic, pid))
+    client._pid = 0xFFFE
+
+    network.publish_pipelined(publish_all(client, 5))
+
+    pids = [_publish_packet_id(packet) for packet in broker.sent]
+    assert pids == [0xFFFF, 1, 2, 3, 4]
+    assert len(acks) == 5
+    assert published == [(f"magtag/sensor/{i}", pid) for i, pid in enumerate(pids)]
+    assert client._last_msg_sent_timestamp != 0
+
+
+def test_qos_0_publishes_are_sent_directly(network, client, broker):
+    network.publish_pipelined(publish_all(client, 2, qos=0))
+    assert len(broker.sent) == 6  # fixed header, variable header and payload each
+    assert not broker.rx
+
+
+def test_other_packets_are_skipped(network, client, broker):
+    # A SUBACK waiting ahead of the PUBACKs
+    broker.rx.extend(b"\x90\x03\x00\x01\x00")
+    network.publish_pipelined(publish_all(client, 3))
+    assert not broker.rx
+
+
+def test_unacked_message_is_retransmitted_with_dup(network, client, broker):
+    network.PUBLISH_RETRY_SEC = 0
+    broker.drop.add(2)
+
+    network.publish_pipelined(publish_all(client, 3))
+
+    retransmits = [packet for packet in broker.sent if packet[0] & MagtagNetwork.MQTT_PUBLISH_DUP]
+    assert [_publish_packet_id(packet) for packet in retransmits] == [2]
+    assert len(broker.sent) == 4
+
+
+def test_unacked_and_unsent_messages_fail(network, client, broker):
+    network.PUBLISH_TIMEOUT_SEC = 0
+    broker.ack = False
+
+    with pytest.raises(MQTT.MMQTTException, match="5 messages were not acknowledged"):
+        network.publish_pipelined(publish_all(client, 5))
+    assert len(broker.sent) == 2
+
+
+def test_disconnected_client_raises_state_error(network, client, broker):
+    client._is_connected = False
+    with pytest.raises(MQTT.MMQTTStateError):
+        network.publish_pipelined(publish_all(client, 1))
+    assert not broker.sent
+
+
+@pytest.mark.parametrize("topic, msg", [
+    ("magtag/sensor", None),
+    ("magtag/sensor", [1]),
+    ("magtag/#", "1"),
+    ("", "1"),
+])
+def test_invalid_publish_raises_value_error(network, client, broker, topic, msg):
+    with pytest.raises(ValueError):
+        network.publish_pipelined(lambda: client.publish(topic, msg, qos=1))
+    assert not broker.sent
@@ -0,0 +1,65 @@
+import random
+
+import pytest
+
+from memory import BackupRAM
+from rollup import Rollup
+
+
+@pytest.fixture
+def rollup():
+    rollup = Rollup(BackupRAM(reset=True), "co2")
+    rollup.add_elements()
+    return rollup
+
+
+def test_no_samples_has_no_stats(rollup):
+    for stat in Rollup.STATS:
+        assert rollup.get_stat(stat) is None
+
+
+def test_few_samples_use_exact_quantile(rollup):
+    for value in (5.0, 1.0, 3.0):
+        rollup.add(value)
+    rollup.add(None)
+
+    assert rollup.count() == 3
+    assert rollup.get_stat("Min") == 1.0
+    assert rollup.get_stat("Max") == 5.0
+    assert rollup.get_stat("Mean") == pytest.approx(3.0)
+    assert rollup.get_stat("P95") == 5.0
+
+
+def test_p95_estimate_matches_exact_quantile(rollup):
+    rand = random.Random(1)
+    samples = [rand.gauss(0, 1) for _ in range(2000)]
+    for value in samples:
+        rollup.add(value)
+
+    ordered = sorted(samples)
+    assert rollup.count() == len(samples)
+    assert rollup.get_stat("Min") == pytest.approx(ordered[0], abs=1e-6)
+    assert rollup.get_stat("Max") == pytest.approx(ordered[-1], abs=1e-6)
+    assert rollup.get_stat("Mean") == pytest.approx(sum(samples) / len(samples), abs=1e-3)
+    assert rollup.get_stat("P95") == pytest.approx(ordered[round(0.95 * (len(samples) - 1))], abs=0.01)
+
+
+def test_reset_starts_a_new_window(rollup):
+    for value in range(10):
+        rollup.add(float(value))
+    rollup.reset()
+
+    assert rollup.count() == 0
+    assert rollup.get_stat("Max") is None
+
+    for value in (20.0, 30.0):
+        rollup.add(value)
+    assert rollup.get_stat("Min") == 20.0
+    assert rollup.get_stat("Max") == 30.0
+    assert rollup.get_stat("P95") == 30.0
+
+
+def test_unknown_stat_raises(rollup):
+    rollup.add(1.0)
+    with pytest.raises(ValueError):
+        rollup.get_stat("P50")
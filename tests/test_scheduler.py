@@ -0,0 +1,53 @@
+import pytest
+
+from memory import BackupRAM
+from scheduler import WakeScheduler
+
+START = 1000
+
+
+@pytest.fixture
+def scheduler():
+    backup_ram = BackupRAM(reset=True)
+    scheduler = WakeScheduler(backup_ram)
+    for name, period_sec in (("sample", 120), ("upload", 600), ("time sync", 600), ("display", 120)):
+        backup_ram.add_element(name, "I", START)
+        scheduler.add_task(name, name, period_sec, period_sec // 4)
+    return scheduler
+
+
+def test_next_wake_is_earliest_deadline(scheduler):
+    assert scheduler.next_wake(START) == START + 120
+    assert scheduler.sleep_time(START) == 120
+
+
+def test_overlapping_windows_coalesce(scheduler):
+    # Upload's window opens at 450 sec, so it joins the 480 sec sample wake
+    assert scheduler.due_tasks(START + 360) == ["sample", "display"]
+    assert scheduler.due_tasks(START + 480) == ["sample", "upload", "time sync", "display"]
+
+
+def test_early_run_is_anchored_to_deadline(scheduler):
+    scheduler.mark_run("upload", START + 480)
+    assert scheduler.backup_ram.get_element("upload") == START + 600
+
+    # Late runs restart from the run time
+    scheduler.mark_run("sample", START + 130)
+    assert scheduler.backup_ram.get_element("sample") == START + 130
+
+
+def test_failed_task_does_not_force_immediate_wakes(scheduler):
+    now = START + 600
+    for name in ("sample", "upload", "display"):
+        scheduler.mark_run(name, now)
+
+    # Time sync failed, so it is still due but the next wake waits a period
+    assert "time sync" in scheduler.due_tasks(now)
+    assert scheduler.sleep_time(now) == 120
+    assert "time sync" in scheduler.due_tasks(now + 120)
+
+
+def test_simulate_wakes_per_day(scheduler):
+    assert scheduler.wakes_per_day() == WakeScheduler.SEC_PER_DAY // 120
+    assert scheduler.simulate(WakeScheduler.SEC_PER_DAY, failing=("time sync",)) == \
+        WakeScheduler.SEC_PER_DAY // 120
@@ -0,0 +1,76 @@
+import types
+
+import pytest
+
+from memory import BackupRAM
+from sensor_settings import SensorSettings
+
+
+@pytest.fixture
+def settings():
+    backup_ram = BackupRAM(reset=True)
+    backup_ram.add_element("pressure", "I", 1000)
+    backup_ram.add_element("temp offset", "f", 1.0)
+    backup_ram.add_element("forced cal", "i", -1)
+
+    settings = SensorSettings(backup_ram)
+    settings.add_setting("pressure", "ambient_pressure", 2)
+    settings.add_setting("temp offset", "temperature_offset")
+    settings.add_setting("forced cal", "forced_recalibration_reference", disabled_value=-1)
+    return settings
+
+
+def test_queued_values_are_coalesced_until_flush(settings):
+    for pressure in (1005, 1010, 1008):
+        settings.queue("pressure", pressure)
+    assert settings.backup_ram.get_element("pressure") == 1000
+
+    assert settings.flush() == {"pressure": 1008}
+    assert settings.backup_ram.get_element("pressure") == 1008
+    assert settings.flush() == {}
+
+
+def test_pressure_jitter_within_hysteresis_is_ignored(settings):
+    settings.queue("pressure", 1001)
+    assert settings.flush() == {}
+    assert settings.backup_ram.get_element("pressure") == 1000
+
+    settings.queue("pressure", 998)
+    assert settings.flush() == {"pressure": 998}
+
+
+def test_apply_hook_gets_changes_in_setting_order(settings):
+    applied = []
+    settings.apply_hook = applied.append
+
+    settings.queue("forced cal", 420)
+    settings.queue("temp offset", 1.5)
+    settings.queue("pressure", 1013)
+    settings.flush()
+
+    assert len(applied) == 1
+    assert list(applied[0].items()) == [
+        ("ambient_pressure", 1013), ("temperature_offset", 1.5), ("forced_recalibration_reference", 420)]
+
+
+def test_disabled_value_is_stored_but_not_applied(settings):
+    applied = []
+    settings.apply_hook = applied.append
+    settings.queue("forced cal", 420)
+    settings.flush()
+
+    settings.queue("forced cal", -1)
+    assert settings.flush() == {"forced cal": -1}
+    assert applied == [{"forced_recalibration_reference": 420}]
+
+
+def test_sensor_hook_sets_attributes(settings):
+    sensor = types.SimpleNamespace(ambient_pressure=1000, temperature_offset=1.0)
+    settings.apply_hook = SensorSettings.sensor_hook(sensor)
+
+    settings.queue("pressure", 1013)
+    settings.queue("temp offset", 2.5)
+    settings.flush()
+
+    assert sensor.ambient_pressure == 1013
+    assert sensor.temperature_offset == 2.5
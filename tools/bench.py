@@ -0,0 +1,245 @@
+"""
+Microbenchmarks for the code that runs on every wake.
+
+Runs on a host machine (CPython) with stand-ins for the CircuitPython-only
+modules. Reports ops/sec, the peak bytes allocated by a single call and the
+memory blocks retained per call (tracemalloc), then compares against a
+stored baseline so each change shows its delta.
+
+Usage:
+    python tools/bench.py            # run and compare against the baseline
+    python tools/bench.py --save     # run and store a new baseline
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+import types
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TOOLS_DIR, ".."))
+
+BASELINE_PATH = os.path.join(TOOLS_DIR, "bench_baseline.json")
+MIN_RUN_SEC = 0.2
+ELEMENT_COUNTS = (8, 32)
+
+
+class _NullWriter():
+    """Discards captured prints without buffering them, so they don't show
+    up as retained blocks.
+    """
+
+    def write(self, text: str) -> int:
+        return len(text)
+
+    def flush(self) -> None:
+        pass
+
+
+DEVNULL = _NullWriter()
+
+
+class _Stub():
+    """Accepts any constructor arguments and attribute assignments."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        self.__dict__.update(kwargs)
+
+    def __call__(self, *args, **kwargs):
+        return _Stub()
+
+    def __getattr__(self, name):
+        return _Stub()
+
+    def __setitem__(self, key, value) -> None:
+        pass
+
+    def append(self, item) -> None:
+        pass
+
+
+def _install_stand_ins() -> None:
+    """Register stand-ins for the CircuitPython modules imported by the
+    device code so it can run on CPython.
+    """
+    def module(name, **attrs):
+        mod = types.ModuleType(name)
+        mod.__dict__.update(attrs)
+        sys.modules.setdefault(name, mod)
+        return sys.modules[name]
+
+    class MMQTTException(Exception):
+        pass
+
+    module("micropython", const=lambda value: value)
+    module("alarm", sleep_memory=bytearray(8192), wake_alarm=None)
+    module("board", DISPLAY=_Stub(width=296, height=128, time_to_refresh=0), D13=None)
+    module("displayio", Bitmap=_Stub, Palette=_Stub, TileGrid=_Stub, Group=_Stub)
+    module("terminalio", FONT=None)
+    text = module("adafruit_display_text")
+    text.label = module("adafruit_display_text.label", Label=_Stub)
+    module("supervisor", reload=lambda: None, runtime=_Stub(serial_connected=False))
+    minimqtt = module("adafruit_minimqtt")
+    minimqtt.adafruit_minimqtt = module(
+        "adafruit_minimqtt.adafruit_minimqtt", MQTT=_Stub, MMQTTException=MMQTTException)
+    magtag = module("adafruit_magtag")
+    magtag.magtag = module("adafruit_magtag.magtag", MagTag=_Stub)
+    homeassistant = module("homeassistant")
+    for name, attr in (("device", "HomeAssistantDevice"), ("number", "HomeAssistantNumber"),
+                       ("sensor", "HomeAssistantSensor"), ("device_class", "DeviceClass")):
+        setattr(homeassistant, name, module(f"homeassistant.{name}", **{attr: _Stub}))
+    for name in ("adafruit_ntp", "adafruit_ticks", "busio", "digitalio", "rtc", "socketpool", "ssl", "wifi"):
+        module(name, __getattr__=lambda attr: _Stub)
+    module("secrets", secrets={})
+
+
+_install_stand_ins()
+
+import app  # noqa: E402
+
+from display import MagtagDisplay  # noqa: E402
+from memory import BackupRAM  # noqa: E402
+
+
+def measure(func) -> dict:
+    """Time `func` until MIN_RUN_SEC has passed, then measure the allocations
+    of a single call and the blocks retained over a batch of calls.
+    """
+    with contextlib.redirect_stdout(DEVNULL):
+        func()
+
+        iterations = 0
+        start = time.perf_counter()
+        elapsed = 0.0
+        while elapsed < MIN_RUN_SEC:
+            func()
+            iterations += 1
+            elapsed = time.perf_counter() - start
+
+        tracemalloc.start()
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+
+        snapshot_before = tracemalloc.take_snapshot()
+        for _ in range(100):
+            func()
+        snapshot_after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+    retained = sum(stat.count_diff for stat in snapshot_after.compare_to(snapshot_before, "filename"))
+    return {
+        "ops_per_sec": iterations / elapsed,
+        "alloc_bytes": peak - before,
+        "retained_blocks": retained / 100,
+    }
+
+
+def _backup_ram(num_elements: int) -> BackupRAM:
+    backup_ram = BackupRAM()
+    with contextlib.redirect_stdout(DEVNULL):
+        backup_ram.reset()
+    for i in range(num_elements):
+        backup_ram.add_element(f"element {i}", "I" if i % 2 else "f", i)
+    return backup_ram
+
+
+def bench_backup_ram() -> dict:
+    results = {}
+    for count in ELEMENT_COUNTS:
+        backup_ram = _backup_ram(count)
+        name = f"element {count // 2}"
+        results[f"BackupRAM.__init__ ({count} elems)"] = measure(BackupRAM)
+        results[f"BackupRAM.get_element ({count} elems)"] = measure(
+            lambda: backup_ram.get_element(name))
+        results[f"BackupRAM.set_element ({count} elems)"] = measure(
+            lambda: backup_ram.set_element(name, 7))
+        results[f"BackupRAM.reset + add_element x{count}"] = measure(lambda: _backup_ram(count))
+
+    return results
+
+
+def bench_display() -> dict:
+    display = MagtagDisplay()
+    return {
+        "MagtagDisplay._build_text_batt": measure(lambda: display._build_text_batt(3.71)),
+        "MagtagDisplay._build_text_co2": measure(lambda: display._build_text_co2(812.4)),
+        "MagtagDisplay._build_text_hum": measure(lambda: display._build_text_hum(41.7)),
+        "MagtagDisplay._build_text_temp": measure(lambda: display._build_text_temp(71.3)),
+        "MagtagDisplay._build_text_datetime": measure(
+            lambda: display._build_text_datetime("Updated: 12:00:00. Uploaded: 11:50:00")),
+        "MagtagDisplay.update_batt": measure(lambda: display.update_batt(3.71)),
+        "MagtagDisplay.update_co2": measure(lambda: display.update_co2(812.4)),
+        "MagtagDisplay.update_hum": measure(lambda: display.update_hum(41.7)),
+        "MagtagDisplay.update_temp": measure(lambda: display.update_temp(71.3)),
+        "MagtagDisplay.update_datetime": measure(
+            lambda: display.update_datetime("Updated: 12:00:00. Uploaded: 11:50:00")),
+    }
+
+
+def bench_app() -> dict:
+    with contextlib.redirect_stdout(DEVNULL):
+        app.backup_ram.reset()
+    app.backup_ram.add_element(app.BACKUP_NAME_PRESSURE, "I", app.config["ambient_pressure"])
+    app.backup_ram.add_element(app.BACKUP_NAME_CAL, "i", app.FORCE_CAL_DISABLED)
+    app.backup_ram.add_element(app.BACKUP_NAME_TEMP_OFFSET, "f", app.config["temp_offset_c"])
+    app.live_config.add_elements()
+
+    epoch = 1700000000
+    cmd = json.dumps({app.NUMBER_NAME_CO2_REF: 420, app.NUMBER_NAME_TEMP_OFFSET: 1.5})
+    new_config = json.dumps({"upload_rate_sec": 900, "deep_sleep_sec": 180})
+    return {
+        "app.get_fmt_time": measure(lambda: app.get_fmt_time(epoch)),
+        "app.get_fmt_date": measure(lambda: app.get_fmt_date(epoch)),
+        "app.mqtt_message (pressure)": measure(
+            lambda: app.mqtt_message(None, app.config["pressure_topic"], "1013.2")),
+        "app.mqtt_message (cmd)": measure(
+            lambda: app.mqtt_message(None, app.config["cmd_topic"], cmd)),
+        "app.mqtt_message (config)": measure(
+            lambda: app.mqtt_message(None, app.config["config_topic"], new_config)),
+    }
+
+
+def report(results: dict, baseline: dict) -> None:
+    width = max(len(name) for name in ("benchmark", *results))
+    print(f"{'benchmark':<{width}} {'ops/sec':>12} {'delta':>8} {'alloc B':>8} {'delta':>8} {'blocks':>7}")
+    for name, result in results.items():
+        base = baseline.get(name)
+        ops_delta = alloc_delta = ""
+        if base:
+            ops_delta = f"{(result['ops_per_sec'] / base['ops_per_sec'] - 1) * 100:+.1f}%"
+            alloc_delta = f"{result['alloc_bytes'] - base['alloc_bytes']:+d}"
+        print(f"{name:<{width}} {result['ops_per_sec']:>12.0f} {ops_delta:>8} "
+              f"{result['alloc_bytes']:>8} {alloc_delta:>8} {result['retained_blocks']:>7.2f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the wake path microbenchmarks")
+    parser.add_argument("--save", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline file path")
+    args = parser.parse_args()
+
+    results = {}
+    results.update(bench_backup_ram())
+    results.update(bench_display())
+    results.update(bench_app())
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    report(results, baseline)
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+        print(f"Saved baseline to {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+"""
+Fleet load simulator.
+
+Runs many virtual Magtag devices against a local MQTT broker from a host
+machine (CPython). Each device uses the real `MagtagNetwork`,
+`HomeAssistantDevice` and `WakeScheduler` logic, while wake times are
+scheduled on a virtual clock so hours of fleet activity run in seconds. Devices that wake in the
+same virtual second run concurrently, which reproduces discovery bursts,
+retained message fan-out and connect storms after a power cut.
+
+Requires adafruit-circuitpython-minimqtt and the homeassistant library on
+the host python path. CircuitPython-only modules are replaced by stand-ins.
+
+Usage:
+    python tools/fleet_sim.py --devices 50 --duration 3600 --jitter 30
+"""
+import argparse
+import heapq
+import os
+import random
+import socket
+import sys
+import threading
+import time
+import types
+
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+class SimulatedReload(Exception):
+    """Raised in place of supervisor.reload() so a device restart is counted."""
+
+
+def _supervisor_reload():
+    raise SimulatedReload()
+
+
+def _install_stand_ins() -> None:
+    """Register stand-ins for the CircuitPython modules imported by the
+    device code so it can run on CPython.
+    """
+    def module(name, **attrs):
+        mod = types.ModuleType(name)
+        mod.__dict__.update(attrs)
+        sys.modules.setdefault(name, mod)
+        return sys.modules[name]
+
+    module("micropython", const=lambda value: value)
+    module("supervisor", reload=_supervisor_reload, runtime=types.SimpleNamespace(serial_connected=False))
+    module("alarm", sleep_memory=bytearray(8192), wake_alarm=None)
+    module("rtc", RTC=lambda: types.SimpleNamespace(datetime=None))
+    module("wifi", radio=types.SimpleNamespace(ipv4_address="127.0.0.1", ping=lambda ip: 0.001))
+    magtag = module("adafruit_magtag")
+    magtag.magtag = module("adafruit_magtag.magtag", MagTag=object)
+    try:
+        import adafruit_ntp  # noqa: F401
+    except ImportError:
+        module("adafruit_ntp", NTP=object)
+
+
+_install_stand_ins()
+
+import adafruit_minimqtt.adafruit_minimqtt as MQTT  # noqa: E402
+
+from config import config  # noqa: E402
+from homeassistant.device import HomeAssistantDevice  # noqa: E402
+from homeassistant.device_class import DeviceClass  # noqa: E402
+from homeassistant.sensor import HomeAssistantSensor  # noqa: E402
+from network import MagtagNetwork  # noqa: E402
+from scheduler import WakeScheduler  # noqa: E402
+
+# Exceptions `app.main` catches around discovery and publishing
+MAIN_LOOP_ERRORS = (OSError, ValueError, RuntimeError, MQTT.MMQTTException)
+
+# Deep sleep tasks, same as `app.main`
+SCHEDULER_TOLERANCE_DIVISOR = 4
+TASK_SAMPLE = "sample"
+TASK_UPLOAD = "upload"
+TASK_TIME_SYNC = "time sync"
+TASK_DISPLAY = "display"
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class FleetStats():
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.connect_latency = []
+        self.publish_latency = []
+        self.published = 0
+        self.received = 0
+        self.reloads = 0
+        self.discovery_failures = 0
+        self.publish_failures = 0
+        self.connects_per_sec = {}
+        self.msgs_per_min = {}
+        self.burst_rates = []
+
+    def add_connect(self, virtual_sec: int, latency: float) -> None:
+        with self.lock:
+            self.connect_latency.append(latency)
+            self.connects_per_sec[virtual_sec] = self.connects_per_sec.get(virtual_sec, 0) + 1
+
+    def add_publish(self, virtual_sec: int, latency: float) -> None:
+        with self.lock:
+            self.publish_latency.append(latency)
+            self.published += 1
+            minute = virtual_sec // 60
+            self.msgs_per_min[minute] = self.msgs_per_min.get(minute, 0) + 1
+
+    def add_received(self) -> None:
+        with self.lock:
+            self.received += 1
+
+    def add_reload(self) -> None:
+        with self.lock:
+            self.reloads += 1
+
+    def add_discovery_failure(self) -> None:
+        with self.lock:
+            self.discovery_failures += 1
+
+    def add_publish_failure(self) -> None:
+        with self.lock:
+            self.publish_failures += 1
+
+    def report(self) -> None:
+        def latency_line(name, values):
+            print(f"{name} latency ms (n={len(values)}): "
+                  f"p50 {percentile(values, 50) * 1000:.1f}, "
+                  f"p95 {percentile(values, 95) * 1000:.1f}, "
+                  f"p99 {percentile(values, 99) * 1000:.1f}, "
+                  f"max {max(values, default=0) * 1000:.1f}")
+
+        print("")
+        print("Fleet simulation results")
+        print(f"Messages published: {self.published}")
+        print(f"Messages received: {self.received}")
+        print(f"Reloads: {self.reloads}")
+        print(f"Discovery failures: {self.discovery_failures}")
+        print(f"Publish failures: {self.publish_failures}")
+        print(f"Peak connects per virtual sec: {max(self.connects_per_sec.values(), default=0)}")
+        print(f"Peak messages per virtual min: {max(self.msgs_per_min.values(), default=0)}")
+        print(f"Peak broker message rate: {max(self.burst_rates, default=0):.1f} msg/s")
+        latency_line("Connect", self.connect_latency)
+        latency_line("Publish", self.publish_latency)
+
+
+class FakeMagtagNetwork():
+    """Stand-in for `MagTag.network`; the host is always online."""
+
+    def __init__(self) -> None:
+        self.enabled = True
+
+    @property
+    def is_connected(self) -> bool:
+        return self.enabled
+
+    def connect(self, max_attempts: int = None) -> None:
+        self.enabled = True
+
+
+class DeviceBackupRAM():
+    """Per device stand-in for `BackupRAM`, which keeps its elements in
+    alarm.sleep_memory and so would be shared by every device here.
+    """
+
+    def __init__(self) -> None:
+        self.elements = {}
+
+    def get_element(self, name: str):
+        return self.elements[name]
+
+    def set_element(self, name: str, value) -> None:
+        self.elements[name] = value
+
+
+class VirtualDevice():
+    def __init__(self, index: int, args: argparse.Namespace, stats: FleetStats) -> None:
+        self.index = index
+        self.stats = stats
+        self.virtual_sec = 0
+        self.first_boot = True
+
+        self.scheduler = WakeScheduler(DeviceBackupRAM())
+        tasks = (
+            (TASK_SAMPLE, config["deep_sleep_sec"]),
+            (TASK_UPLOAD, config["upload_rate_sec"]),
+            (TASK_TIME_SYNC, config["time_sync_rate_sec"]),
+            (TASK_DISPLAY, config["deep_sleep_sec"]),
+        )
+        for name, period_sec in tasks:
+            self.scheduler.add_task(name, name, period_sec, period_sec // SCHEDULER_TOLERANCE_DIVISOR)
+
+        self.mqtt_client = MQTT.MQTT(
+            broker=args.broker,
+            port=args.port,
+            client_id=f"magtag-sim-{index}",
+            socket_pool=socket,
+            is_ssl=False,
+            connect_retries=1,
+            recv_timeout=config["light_sleep_sec"],
+            keep_alive=config["deep_sleep_sec"] + 20
+        )
+        self.mqtt_client.on_connect = self._mqtt_connected
+        self.mqtt_client.on_message = self._mqtt_message
+        self._wrap_mqtt_client()
+
+        magtag = types.SimpleNamespace(network=FakeMagtagNetwork())
+        self.network = MagtagNetwork(magtag, self.mqtt_client)
+
+        # QoS 1 messages are sent by the pipelined publish path, which
+        # bypasses the client's publish, so count them as they are acked
+        self.network.on_publish_ack = lambda latency: self.stats.add_publish(self.virtual_sec, latency)
+
+        sensor_co2 = HomeAssistantSensor(
+            "CO2", lambda: random.randint(400, 2000), 0, DeviceClass.CARBON_DIOXIDE, "ppm")
+        self.device = HomeAssistantDevice(f"Sim {index}", "Magtag", self.mqtt_client)
+        self.device.add_sensor(sensor_co2)
+        self.cmd_topic = f"{self.device.number_topic}/cmd"
+
+    def _wrap_mqtt_client(self) -> None:
+        connect = self.mqtt_client.connect
+        publish = self.mqtt_client.publish
+
+        def timed_connect(*args, **kwargs):
+            start = time.monotonic()
+            result = connect(*args, **kwargs)
+            self.stats.add_connect(self.virtual_sec, time.monotonic() - start)
+            return result
+
+        def timed_publish(*args, **kwargs):
+            start = time.monotonic()
+            result = publish(*args, **kwargs)
+            self.stats.add_publish(self.virtual_sec, time.monotonic() - start)
+            return result
+
+        self.mqtt_client.connect = timed_connect
+        self.mqtt_client.publish = timed_publish
+
+    def _reset_schedule(self, virtual_sec: int) -> None:
+        # First boot starts every task from now, as `app.main` does
+        for backup_name, _, _ in self.scheduler.tasks.values():
+            self.scheduler.backup_ram.set_element(backup_name, virtual_sec)
+
+    def _mqtt_connected(self, client, user_data, flags, rc) -> None:
+        # Same subscriptions as `app.mqtt_connected`
+        client.subscribe(config["pressure_topic"])
+        client.subscribe(self.cmd_topic)
+        client.subscribe(config["config_topic"])
+
+    def _mqtt_message(self, client, topic, message) -> None:
+        self.stats.add_received()
+
+    def wake(self, virtual_sec: int) -> None:
+        """Run one wake cycle of the deep sleep path from `app.main`."""
+        self.virtual_sec = virtual_sec
+        if self.first_boot:
+            self._reset_schedule(virtual_sec)
+        due_tasks = self.scheduler.due_tasks(virtual_sec)
+
+        try:
+            self.device.read_sensors(cache=True)
+            self.scheduler.mark_run(TASK_SAMPLE, virtual_sec)
+
+            # The host clock is already synced, so only the connect is simulated
+            if TASK_TIME_SYNC in due_tasks or self.first_boot:
+                self.network.connect()
+                self.scheduler.mark_run(TASK_TIME_SYNC, virtual_sec)
+
+            if TASK_UPLOAD in due_tasks or self.first_boot:
+                self.network.connect()
+
+                # Same failure handling as `app.main`: a discovery failure
+                # reboots, a publish failure is logged and the wake goes on
+                try:
+                    self.device.send_discovery()
+                except MAIN_LOOP_ERRORS:
+                    self.stats.add_discovery_failure()
+                    _supervisor_reload()
+
+                self.network.loop()
+                try:
+                    self.network.publish_pipelined(self.device.publish_numbers, self.device.publish_sensors)
+                except MAIN_LOOP_ERRORS:
+                    self.stats.add_publish_failure()
+                self.scheduler.mark_run(TASK_UPLOAD, virtual_sec)
+
+            if TASK_DISPLAY in due_tasks or self.first_boot:
+                self.scheduler.mark_run(TASK_DISPLAY, virtual_sec)
+
+            if self.network.is_connected():
+                self.network.disconnect()
+        except SimulatedReload:
+            # A reload reboots the device, which is a first boot again
+            self.stats.add_reload()
+            self.first_boot = True
+            return
+
+        self.first_boot = False
+
+    def next_wake(self, virtual_sec: int) -> int:
+        # A reloaded device restarts straight away
+        if self.first_boot:
+            return virtual_sec + 1
+        return virtual_sec + self.scheduler.sleep_time(virtual_sec)
+
+
+def run(args: argparse.Namespace) -> FleetStats:
+    stats = FleetStats()
+    rand = random.Random(args.seed)
+
+    retained = []
+    if args.pressure is not None:
+        retained.append((config["pressure_topic"], str(args.pressure)))
+    if args.config is not None:
+        retained.append((config["config_topic"], args.config))
+    if retained:
+        publisher = MQTT.MQTT(broker=args.broker, port=args.port, socket_pool=socket, is_ssl=False)
+        publisher.connect()
+        for topic, msg in retained:
+            publisher.publish(topic, msg, retain=True)
+        publisher.disconnect()
+
+    devices = [VirtualDevice(i, args, stats) for i in range(args.devices)]
+
+    # Wake queue on the virtual clock: (virtual sec, device index). All
+    # devices power on at once, optionally spread by the wake jitter.
+    queue = [(rand.randint(0, args.jitter), i) for i in range(args.devices)]
+    heapq.heapify(queue)
+
+    with ThreadPoolExecutor(max_workers=args.devices) as executor:
+        while queue and queue[0][0] <= args.duration:
+            virtual_sec = queue[0][0]
+            batch = []
+            while queue and queue[0][0] == virtual_sec:
+                batch.append(heapq.heappop(queue)[1])
+
+            published_before = stats.published
+            start = time.monotonic()
+            list(executor.map(lambda i: devices[i].wake(virtual_sec), batch))
+            elapsed = time.monotonic() - start
+            if stats.published > published_before and elapsed > 0:
+                stats.burst_rates.append((stats.published - published_before) / elapsed)
+
+            for i in batch:
+                next_wake = devices[i].next_wake(virtual_sec) + rand.randint(0, args.jitter)
+                heapq.heappush(queue, (next_wake, i))
+
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Simulate a fleet of Magtag CO2 devices")
+    parser.add_argument("--devices", type=int, default=20, help="number of virtual devices")
+    parser.add_argument("--duration", type=int, default=3600, help="virtual seconds to simulate")
+    parser.add_argument("--jitter", type=int, default=0, help="max random wake jitter in seconds")
+    parser.add_argument("--broker", default="localhost", help="MQTT broker host")
+    parser.add_argument("--port", type=int, default=1883, help="MQTT broker port")
+    parser.add_argument("--pressure", type=int, default=None,
+                        help="publish a retained pressure value before starting")
+    parser.add_argument("--config", default=None,
+                        help="publish a retained config JSON object before starting")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    args = parser.parse_args()
+
+    run(args).report()
+
+
+if __name__ == "__main__":
+    main()